@@ -7,6 +7,8 @@ from fastapi import FastAPI, Request, Response, Body
 from fastapi.middleware.cors import CORSMiddleware
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from twilio.rest import Client
+from ivr_idempotency import IdempotencyMiddleware
+from ivr_traffic import CAPTURE_FILE, TrafficCaptureMiddleware
 import os
 
 # Configuration
@@ -29,6 +31,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Answer retried Twilio webhooks from cache instead of re-running intent logic
+app.add_middleware(IdempotencyMiddleware, paths=["/conversation"])
+
+# Record webhook traffic for ivr_replay.py when IVR_CAPTURE_FILE is set
+if CAPTURE_FILE:
+    app.add_middleware(TrafficCaptureMiddleware, path=CAPTURE_FILE, paths=["/conversation"])
+
 
 #Intent Keyword Mapping 
 
@@ -0,0 +1,217 @@
+# ============================================================
+# Idempotent Webhook Processing (shared by both IVR backends)
+# ============================================================
+#
+# Twilio retries a webhook when our response is slow, and the simulator
+# frontend re-submits on slow responses. Without this layer a retried
+# /ivr/dtmf appends the same digit twice and a retried /conversation
+# re-runs intent detection. The middleware below keys each request on
+# the call id plus an idempotency key and answers duplicates from a
+# bounded TTL cache of the finished response bytes.
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+# Headers that carry a per-request idempotency key, in priority order.
+# Twilio sends I-Twilio-Idempotency-Token on every webhook and keeps it
+# identical across retries of the same request.
+IDEMPOTENCY_HEADERS = (b"idempotency-key", b"i-twilio-idempotency-token")
+
+# Body fields that identify the call (Twilio form posts / simulator JSON)
+CALL_ID_FIELDS = ("CallSid", "call_id")
+
+# Body field the simulator can send as a per-call request sequence number
+SEQUENCE_FIELD = "seq"
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class ResponseCache:
+    """Bounded TTL cache of finished responses keyed on (method, path, call id, key)."""
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def _expire(self, now):
+        while self._entries:
+            key, (stored_at, _) = next(iter(self._entries.items()))
+            if now - stored_at < self.ttl:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def put(self, key, response):
+        now = time.monotonic()
+        self._entries[key] = (now, response)
+        self._entries.move_to_end(key)
+        self._expire(now)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def request_fields(content_type, body):
+    """Parse a form or JSON body into a dict of fields, or None if unreadable."""
+    try:
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+        if content_type.startswith("application/json") and body:
+            parsed = json.loads(body)
+            return parsed if isinstance(parsed, dict) else {}
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return {}
+
+
+def _request_identity(scope, body):
+    """Return the cache key (method, path, call id, key), or None if not keyed."""
+    headers = dict(scope.get("headers") or [])
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+
+    fields = request_fields(content_type, body)
+    if fields is None:
+        return None
+
+    call_id = next((fields[f] for f in CALL_ID_FIELDS if fields.get(f)), None)
+    if not call_id:
+        return None
+
+    key = next((headers[h].decode("latin-1") for h in IDEMPOTENCY_HEADERS if headers.get(h)), None)
+    if key is None and fields.get(SEQUENCE_FIELD) is not None:
+        key = f"seq:{fields[SEQUENCE_FIELD]}"
+    if key is None:
+        return None
+
+    return (scope["method"], scope["path"], str(call_id), key)
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware that replays the cached response for duplicate webhooks.
+
+    Only requests to `paths` that carry both a call id and an idempotency
+    key (header or `seq` body field) are cached; everything else passes
+    straight through. A duplicate that arrives while the original is still
+    being handled waits for it instead of running the handler a second time.
+    Reusing a key with a different body is rejected with 409.
+    """
+
+    def __init__(self, app, paths, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.app = app
+        self.paths = set(paths)
+        self.cache = ResponseCache(ttl=ttl, max_entries=max_entries)
+        self._in_flight = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        body = await read_body(receive)
+        key = _request_identity(scope, body)
+        if key is None:
+            await self.app(scope, replay_receive(body, receive), send)
+            return
+
+        digest = hashlib.sha256(body).hexdigest()
+
+        # Wait out any in-flight original, then re-check: if it was not
+        # cached (e.g. it failed) the first waiter to wake runs the handler.
+        while True:
+            cached = self.cache.get(key)
+            pending = self._in_flight.get(key)
+            if cached is not None or pending is None:
+                break
+            if pending[0] != digest:
+                await _send_conflict(send)
+                return
+            await asyncio.shield(pending[1])
+
+        if cached is not None:
+            if cached["digest"] != digest:
+                await _send_conflict(send)
+                return
+            print(f"🔁 Duplicate webhook answered from cache: {scope['path']} call {key[2]}")
+            await _send_cached(cached, send)
+            return
+
+        entry = (digest, asyncio.get_running_loop().create_future())
+        self._in_flight[key] = entry
+        captured = {"status": 500, "headers": [], "body": b"", "digest": digest}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["headers"] = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                captured["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive(body, receive), capture_send)
+        finally:
+            if self._in_flight.get(key) is entry:
+                del self._in_flight[key]
+            # Only successful responses are cached, so a retry after an
+            # error (4xx validation or 5xx) still reaches the handler
+            if 200 <= captured["status"] < 400:
+                self.cache.put(key, captured)
+            entry[1].set_result(None)
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    return body
+
+
+def replay_receive(body, receive):
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+async def _send_cached(cached, send):
+    await send({
+        "type": "http.response.start",
+        "status": cached["status"],
+        "headers": cached["headers"] + [(b"idempotent-replay", b"true")],
+    })
+    await send({"type": "http.response.body", "body": cached["body"]})
+
+
+async def _send_conflict(send):
+    body = json.dumps({"detail": "Idempotency key reused with a different request body"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 409,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,251 @@
+# ============================================================
+# IVR Traffic Replay (regression + capacity testing)
+# ============================================================
+#
+# Re-drives a capture recorded by TrafficCaptureMiddleware (ivr_traffic.py)
+# against an IVR app in-process, checks every response against the one
+# recorded in production and reports per-endpoint latency.
+#
+# Usage:
+#   python ivr_replay.py traffic.jsonl ivr_simulator_backend.py:app
+#   python ivr_replay.py traffic.jsonl ivr_simulator_backend.py:app --speed 10
+#   python ivr_replay.py traffic.jsonl ivr_simulator_backend.py:app --speed max \
+#       --against ../baseline/ivr_simulator_backend.py:app
+#   python ivr_replay.py traffic.jsonl ivr_backend.py:app --save-report new.json \
+#       --baseline-report old.json
+#
+# Requests of one call are sent strictly in their recorded order; different
+# calls run concurrently. --speed 1 keeps the recorded pacing, --speed N
+# compresses it N times and --speed max sends each request as soon as the
+# previous one for the same call has finished.
+#
+# Simulator call ids are assigned by /ivr/start (CALL_ + six digits) and
+# differ on every run. The replay maps recorded ids to replayed ones and
+# rewrites them in request/response text by pattern; ids of any other
+# shape (Twilio CallSids, client-chosen values) are sent unchanged.
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+from ivr_traffic import call_id_of, load_capture
+
+
+def load_app(spec):
+    """
+    Load a fresh ASGI app from 'path/to/module.py:attr'.
+
+    The module and the sibling modules it imports from its own directory
+    (ivr_idempotency, ivr_traffic, ...) are executed from that directory,
+    so two checkouts can be compared in one process without sharing code.
+    """
+    path, _, attr = spec.partition(":")
+    path = os.path.abspath(path)
+    build_dir = os.path.dirname(path)
+    siblings = {os.path.splitext(f)[0] for f in os.listdir(build_dir) if f.endswith(".py")}
+
+    def is_sibling(module_name):
+        return module_name.split(".")[0] in siblings
+
+    saved = {n: sys.modules.pop(n) for n in list(sys.modules) if is_sibling(n)}
+    name = f"_replay_{len(sys.modules)}_{os.path.splitext(os.path.basename(path))[0]}"
+    module_spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(module_spec)
+    sys.path.insert(0, build_dir)
+    try:
+        module_spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(build_dir)
+        for n in [n for n in sys.modules if is_sibling(n)]:
+            del sys.modules[n]
+        sys.modules.update(saved)
+    return getattr(module, attr or "app")
+
+
+# Shape of the call ids the simulator assigns in /ivr/start
+SIMULATOR_CALL_ID = re.compile(r"\bCALL_\d{6}\b")
+
+
+def _rewrite(text, ids):
+    """Replace every simulator call id found in `ids` in a single pass."""
+    return SIMULATOR_CALL_ID.sub(lambda m: ids.get(m.group(0), m.group(0)), text)
+
+
+def _normalize(text, ids):
+    """Rewrite replayed call ids back to the recorded ones for comparison."""
+    text = _rewrite(text, {replayed: recorded for recorded, replayed in ids.items()})
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+async def _replay_call(client, records, origin, clock, speed, results):
+    # Server-assigned call ids (/ivr/start) differ on every run; map them
+    ids = {}
+    for record in records:
+        if speed:
+            delay = clock + (record["t"] - origin) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        url = record["p"]
+        query = _rewrite(record.get("q", ""), ids)
+        if query:
+            url = f"{url}?{query}"
+
+        started = time.monotonic()
+        resp = await client.request(
+            record["m"], url,
+            content=_rewrite(record["b"], ids).encode("utf-8"),
+            headers=record["h"],
+        )
+        elapsed = (time.monotonic() - started) * 1000
+
+        replayed_id = call_id_of(resp.headers.get("content-type", ""), resp.content)
+        if (record["call"] and replayed_id and record["call"] not in ids
+                and SIMULATOR_CALL_ID.fullmatch(record["call"])
+                and SIMULATOR_CALL_ID.fullmatch(replayed_id)):
+            ids[record["call"]] = replayed_id
+
+        matched = (resp.status_code == record["s"]
+                   and _normalize(resp.text, ids) == _normalize(record["r"], {}))
+        result = {"endpoint": f"{record['m']} {record['p']}", "ms": elapsed,
+                  "recorded_ms": record["ms"], "match": matched}
+        if not matched:
+            result["detail"] = (f"call {record['call']}: {record['s']} {record['r'][:80]!r} "
+                                f"-> {resp.status_code} {resp.text[:80]!r}")
+        results.append(result)
+
+
+async def replay(app, records, speed=1.0):
+    """Replay `records` against `app` and return one result per request."""
+    calls = defaultdict(list)
+    for i, record in enumerate(records):
+        calls[record["call"] or f"_uncorrelated_{i}"].append(record)
+
+    results = []
+    origin = records[0]["t"] if records else 0
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay") as client:
+        clock = time.monotonic()
+        await asyncio.gather(*(
+            _replay_call(client, call_records, origin, clock, speed, results)
+            for call_records in calls.values()
+        ))
+    return results
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(results):
+    """Per-endpoint (method + path) request count, mismatches and latency percentiles (ms)."""
+    by_endpoint = defaultdict(list)
+    for result in results:
+        by_endpoint[result["endpoint"]].append(result)
+
+    report = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        latencies = [r["ms"] for r in rows]
+        report[endpoint] = {
+            "requests": len(rows),
+            "mismatches": sum(1 for r in rows if not r["match"]),
+            "p50_ms": round(_percentile(latencies, 50), 3),
+            "p95_ms": round(_percentile(latencies, 95), 3),
+            "max_ms": round(max(latencies), 3),
+            "recorded_p50_ms": round(_percentile([r["recorded_ms"] for r in rows], 50), 3),
+        }
+    return report
+
+
+def print_report(title, report, baseline=None):
+    print(f"\n{title}")
+    print(f"{'endpoint':<24}{'reqs':>7}{'mismatch':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"
+          + (f"{'Δp50':>10}{'Δp95':>10}" if baseline else ""))
+    for endpoint, row in report.items():
+        line = (f"{endpoint:<24}{row['requests']:>7}{row['mismatches']:>10}"
+                f"{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['max_ms']:>10.3f}")
+        if baseline and endpoint in baseline:
+            line += (f"{row['p50_ms'] - baseline[endpoint]['p50_ms']:>+10.3f}"
+                     f"{row['p95_ms'] - baseline[endpoint]['p95_ms']:>+10.3f}")
+        print(line)
+
+
+def _speed(value):
+    """argparse type for --speed: 'max' (no pacing) or a positive multiplier."""
+    if value == "max":
+        return None
+    try:
+        speed = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a positive number or 'max', got {value!r}")
+    if speed <= 0:
+        raise argparse.ArgumentTypeError(f"speed must be positive, got {value!r}")
+    return speed
+
+
+def measure(spec, records, speed):
+    """Warm up a throwaway instance of a build, then replay against a fresh one."""
+    # The warm-up pays import and first-request costs so that whichever
+    # build runs first is not penalised; it uses its own instance so the
+    # measured run starts from empty call state and idempotency cache.
+    asyncio.run(replay(load_app(spec), records, None))
+    results = asyncio.run(replay(load_app(spec), records, speed))
+    for result in results:
+        if not result["match"]:
+            print(f"❌ Mismatch on {result['endpoint']} {result['detail']}")
+    return summarize(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured IVR webhook traffic in-process.")
+    parser.add_argument("capture", help="capture log written by TrafficCaptureMiddleware")
+    parser.add_argument("app", help="app to replay against, as path/to/module.py:app")
+    parser.add_argument("--speed", type=_speed, default=1.0,
+                        help="pacing multiplier: 1 = recorded timing, N = N times faster, max = no pacing")
+    parser.add_argument("--against", help="baseline build to replay too, as path/to/module.py:app")
+    parser.add_argument("--baseline-report", help="compare against a report saved with --save-report")
+    parser.add_argument("--save-report", help="write this run's per-endpoint report as JSON")
+    args = parser.parse_args(argv)
+
+    # Apps loaded for replay must not capture the replayed traffic, least
+    # of all into the very log being replayed
+    if os.environ.pop("IVR_CAPTURE_FILE", None):
+        print("⚠️  IVR_CAPTURE_FILE is set; capture is disabled for the replayed apps")
+
+    records = load_capture(args.capture)
+    pace = "max speed" if args.speed is None else f"{args.speed:g}x speed"
+    print(f"📼 Replaying {len(records)} requests from {args.capture} at {pace}")
+
+    baseline = None
+    if args.baseline_report:
+        with open(args.baseline_report, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.against:
+        baseline = measure(args.against, records, args.speed)
+        print_report(f"Baseline: {args.against}", baseline)
+
+    report = measure(args.app, records, args.speed)
+    print_report(f"Candidate: {args.app}", report, baseline)
+
+    if args.save_report:
+        with open(args.save_report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if any(row["mismatches"] for row in report.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,6 +11,8 @@ from datetime import datetime
 import random
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from twilio.rest import Client
+from ivr_idempotency import IdempotencyMiddleware
+from ivr_traffic import CAPTURE_FILE, TrafficCaptureMiddleware
 
 # ========s====================================================
 # Initialize App
@@ -27,6 +29,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Answer retried webhooks (Twilio timeouts, frontend double-submits) from cache
+app.add_middleware(IdempotencyMiddleware, paths=["/ivr/dtmf", "/twilio/voice"])
+
+# Record webhook traffic for ivr_replay.py when IVR_CAPTURE_FILE is set
+if CAPTURE_FILE:
+    app.add_middleware(
+        TrafficCaptureMiddleware,
+        path=CAPTURE_FILE,
+        paths=["/ivr/start", "/ivr/dtmf", "/ivr/end", "/twilio/voice"],
+    )
+
 # ============================================================
 # Twilio Configuration
 # ============================================================
@@ -49,6 +62,7 @@ class CallStart(BaseModel):
 class DTMFInput(BaseModel):
     call_id: str
     digit: str
+    seq: Optional[int] = None  # per-call request sequence, used for idempotent retries
 
 class CallLog(BaseModel):
     call_id: str
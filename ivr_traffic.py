@@ -0,0 +1,97 @@
+# ============================================================
+# Webhook Traffic Capture (shared by both IVR backends)
+# ============================================================
+#
+# Records every webhook that reaches the IVR endpoints, with its timing
+# and the response we sent, into a compact JSON-lines log. The log is
+# re-driven against the app by ivr_replay.py to reproduce real call mixes
+# locally for regression and capacity testing.
+#
+# Capture is off unless IVR_CAPTURE_FILE is set:
+#   IVR_CAPTURE_FILE=traffic.jsonl uvicorn ivr_simulator_backend:app
+
+import json
+import os
+import time
+
+from ivr_idempotency import CALL_ID_FIELDS, IDEMPOTENCY_HEADERS, read_body, replay_receive, request_fields
+
+# Capture log path, or None to leave capture disabled
+CAPTURE_FILE = os.environ.get("IVR_CAPTURE_FILE") or None
+
+# Request headers worth keeping so a replay behaves like the original
+CAPTURED_HEADERS = (b"content-type",) + IDEMPOTENCY_HEADERS
+
+
+def call_id_of(content_type, body):
+    """Return the call id carried in a request or response body, if any."""
+    fields = request_fields(content_type, body) or {}
+    call_id = next((fields[f] for f in CALL_ID_FIELDS if fields.get(f)), None)
+    return str(call_id) if call_id else None
+
+
+def load_capture(path):
+    """Load a capture log into a list of records ordered by arrival time."""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r["t"])
+
+
+class TrafficCaptureMiddleware:
+    """
+    ASGI middleware that appends one record per POST to `paths` to `path`.
+
+    Each record holds the arrival time `t` (epoch seconds), method `m`,
+    path `p`, query string `q`, selected headers `h`, request body `b`,
+    call id `call`, response status `s`, response body `r` and latency `ms`.
+    The call id is taken from the response when it carries one (the
+    simulator assigns it in /ivr/start), otherwise from the request.
+    """
+
+    def __init__(self, app, path, paths):
+        self.app = app
+        self.paths = set(paths)
+        self.log = open(path, "a", encoding="utf-8", buffering=1)
+
+    async def __call__(self, scope, receive, send):
+        # Webhooks are POSTs; CORS preflights and other methods are not recorded
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.time()
+        started = time.monotonic()
+        body = await read_body(receive)
+        captured = {"status": 500, "body": b""}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                captured["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive(body, receive), capture_send)
+        finally:
+            headers = dict(scope.get("headers") or [])
+            kept = {k.decode(): headers[k].decode("latin-1") for k in CAPTURED_HEADERS if k in headers}
+            query = scope.get("query_string", b"")
+            # The response wins: /ivr/start ignores any client-sent call_id
+            # and the id it returns is the one later requests carry
+            call_id = (call_id_of("application/json", captured["body"])
+                       or call_id_of(kept.get("content-type", ""), body)
+                       or call_id_of("application/x-www-form-urlencoded", query))
+            record = {
+                "t": round(arrived, 6),
+                "m": scope["method"],
+                "p": scope["path"],
+                "q": query.decode("latin-1"),
+                "h": kept,
+                "b": body.decode("utf-8", "replace"),
+                "call": call_id,
+                "s": captured["status"],
+                "r": captured["body"].decode("utf-8", "replace"),
+                "ms": round((time.monotonic() - started) * 1000, 3),
+            }
+            self.log.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")